@@ -76,6 +76,18 @@ parser.add_argument("-s",
                     "--start",
                     action="store_true",
                     help="start from 'start-from' in the config file")
+# queue logging
+parser.add_argument("-q",
+                    "--queue",
+                    action="store_true",
+                    help="write logs from a background thread")
+# json lines log
+parser.add_argument("-j",
+                    "--jsonlog",
+                    nargs="?",
+                    type=str,
+                    const="./tasks.jsonl",
+                    help="write JSON lines logs to the file; default ./tasks.jsonl")
 # at time
 parser.add_argument("-a",
                     "--at",
@@ -100,12 +112,13 @@ if args.logconfig:  # -lc
     logging.config.dictConfig(logconfig)
     logname = list(logconfig["loggers"].keys())[0]
     logger = logging.getLogger(logname)
-    logger.info("Use logger: %s" % logname)
+    logger.info("Use logger: %s", logname)
 else:
     logger = None
 
 # create the crawler
-sgx = sgx_crawler(args.crawlerconfig, logger, args.start)
+sgx = sgx_crawler(args.crawlerconfig, logger, args.start, args.queue,
+                  args.jsonlog)
 
 if args.showconfig:  # -sc
     show_config(sgx.config, sgx.logger)
@@ -131,8 +144,10 @@ try:
         else:
             sgx.download_history(args.files, args.refresh)
 
+        sgx.close()
+
     else:
-        sgx.logger.info("Run daily at %s" % args.at)
+        sgx.logger.info("Run daily at %s", args.at)
         if args.type == "last":
             schedule.every().day.at(args.at).do(sgx.download_specify,
                                                 args.files, False,
@@ -151,4 +166,5 @@ try:
 except KeyboardInterrupt:
     sgx.logger.exception("Keyboard Interrupt; Exit the program",
                          exc_info=False)
+    sgx.close()
     exit()
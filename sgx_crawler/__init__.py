@@ -6,4 +6,5 @@ A crawler to download SGX data
 __version__ = '1.0.1'
 
 from .sgx_crawler import sgx_crawler
-from .utils import load_config, write_config, get, write, show_config
+from .utils import (load_config, write_config, get, write, show_config,
+                    JsonFormatter, queue_logging, json_logging, task_extra)
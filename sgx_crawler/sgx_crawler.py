@@ -4,7 +4,9 @@ import json
 import logging
 import logging.config
 from datetime import datetime
-from .utils import load_config, write_config, get, write, date_to_index
+from concurrent.futures import ThreadPoolExecutor
+from .utils import (load_config, write_config, get, write, probe,
+                    date_to_index, queue_logging, json_logging, task_extra)
 
 local_crawler_config = os.path.join(os.path.dirname(__file__),
                                     'crawlerconfig.json')
@@ -19,12 +21,16 @@ class sgx_crawler:
     def __init__(self,
                  config_path: str = None,
                  logger: logging.Logger = None,
-                 from_start=False) -> None:
+                 from_start=False,
+                 queue_log=False,
+                 json_log: str = None) -> None:
         """A crawler to download SGX data
 
         :param config_path: the path of the configuration file; if None then use default
         :param logger: the Logger; if None then use default
         :param from_start: start from "start-from" if True else from "resume-from"
+        :param queue_log: write logs from a background thread if True
+        :param json_log: the path to write JSON lines logs; if None then disabled
         """
 
         try:
@@ -35,6 +41,15 @@ class sgx_crawler:
                 logger.info("Use default logger")
 
             self.logger = logger
+            self.log_listener = None
+            self.json_handler = None
+
+            if json_log:  # one JSON line per record with the task fields
+                self.json_handler = json_logging(self.logger, json_log)
+
+            if queue_log:  # handlers do I/O off the download thread
+                self.log_listener = queue_logging(self.logger)
+                self.logger.debug("Use queue logging")
 
             if config_path is None:
                 config_path = local_crawler_config
@@ -58,6 +73,12 @@ class sgx_crawler:
             self.max_pending_len = self.config["max-pending-length"]
             self.datestr = [0, ""]
 
+            # probe the headers of a batch of indices before downloading
+            preflight = self.config.get("preflight", {})
+            self.preflight_batch = preflight.get("batch", 0)  # 0: disabled
+            self.preflight_workers = preflight.get("workers", 8)
+            self.dates = dict()  # dates found by probes
+
             if self.pendings:  # retry first
                 self.retry()
 
@@ -65,6 +86,15 @@ class sgx_crawler:
             self.logger.exception(e, exc_info=False)
             exit()
 
+    def close(self) -> None:
+        """Flush the queued logs and close the JSON lines file"""
+
+        if self.log_listener is not None:
+            self.log_listener.stop()
+
+        if self.json_handler is not None:
+            self.json_handler.close()
+
     def retry(self) -> None:
         """Retry the failed tasks"""
 
@@ -78,8 +108,8 @@ class sgx_crawler:
             self.download_single(*args, refresh=True)
 
         remain = len(self.pendings)
-        self.logger.info("Finish resume: total %d, success: %d, fail: %d" %
-                         (num_pending, num_pending - remain, remain))
+        self.logger.info("Finish resume: total %d, success: %d, fail: %d",
+                         num_pending, num_pending - remain, remain)
 
         self.datestr = last_datestr
 
@@ -87,6 +117,28 @@ class sgx_crawler:
         self.config["failed-tasks"] = self.pendings
         write_config(self.config_path, self.config, self.logger)
 
+    def check_pendings(self) -> bool:
+        """Retry the failed tasks if there are too many of them
+
+        :return: False if the retry failed else True
+        """
+
+        # stop when having too many failed tasks
+        if len(self.pendings) > self.max_pending_len:
+            self.logger.critical("Over %d tasks failed; retry",
+                                 self.max_pending_len)
+
+            # try to resume
+            self.retry()
+
+            # cannot resume any of them
+            if len(self.pendings) >= self.max_pending_len:
+                self.logger.critical(
+                    "Retry failed -- Check Internet Connection")
+                return False
+
+        return True
+
     def download_history(self, files: list, refresh: bool = False) -> None:
         """Download all history files start from self.index
 
@@ -100,24 +152,27 @@ class sgx_crawler:
                 self.retry()
 
             last_date = self.get_last()
-            while self.datestr[1] != last_date:
-
-                # stop when having too many failed tasks
-                if len(self.pendings) > self.max_pending_len:
-                    self.logger.critical("Over %d tasks failed; retry" %
-                                         self.max_pending_len)
+            if last_date is None:
+                self.logger.error(
+                    "Fail to get the last trade date; stop update")
+                return
 
-                    # try to resume
-                    self.retry()
+            while self.datestr[1] != last_date:
 
-                    # cannot resume any of them
-                    if len(self.pendings) >= self.max_pending_len:
-                        self.logger.critical(
-                            "Retry failed -- Check Internet Connection")
+                if not self.check_pendings():
+                    self.index += 1
+                    break
 
-                        self.index += 1
+                # download a planned batch of files
+                if self.preflight_batch > 0:
+                    if not self.download_batch(files, last_date, refresh):
                         break
 
+                    self.config["resume-from"] = self.index
+                    self.config["failed-tasks"] = self.pendings
+                    write_config(self.config_path, self.config, self.logger)
+                    continue
+
                 # download files
                 for id in files:
                     # indicator =
@@ -154,6 +209,149 @@ class sgx_crawler:
         self.config["failed-tasks"] = self.pendings
         write_config(self.config_path, self.config, self.logger)
 
+    def download_batch(self,
+                       files: list,
+                       last_date: str,
+                       refresh: bool = False) -> bool:
+        """Plan and download the next batch of indices start from self.index
+
+        :param files: a list of file_ids, range [0, 3]
+        :param last_date: the last trade date; the indices after it are dropped
+        :param refresh: refresh the existing files with new downloads, default False
+        :return: False if no record found or too many tasks failed else True
+        """
+
+        indices = range(self.index, self.index + self.preflight_batch)
+        plan = self.preflight(indices, files, last_date)
+
+        # no record found in the whole batch
+        if not plan:
+            self.logger.warning("No record found from index %d", self.index)
+            return False
+
+        # stop at the last trade date
+        last_index = next((index for index in indices if index in self.dates
+                           and self.dates[index] == last_date), None)
+        if last_index is not None:
+            plan = [task for task in plan if task[0] <= last_index]
+
+        for i, (index, file_id) in enumerate(plan):
+            if not self.check_pendings():
+                # resume from the first index not finished
+                self.index = min(task[0] for task in plan[i:]) + 1
+                self.dates.clear()
+                return False
+
+            self.download_single(index, file_id, refresh)
+        self.dates.clear()
+
+        if last_index is not None:
+            self.index = last_index + 1
+            self.datestr = [last_index, last_date]
+        else:  # the indices after the last planned one are missing
+            self.index = max(task[0] for task in plan) + 1
+
+        return True
+
+    def preflight(self,
+                  indices: range,
+                  files: list,
+                  last_date: str = None) -> list:
+        """Probe the headers of the files concurrently and plan the downloads
+
+        :param indices: the indices of the trade dates
+        :param files: a list of file_ids, range [0, 3]
+        :param last_date: the last trade date; stop probing after it, default None
+        :return: the plan, a list of (index, file_id) with the largest file first
+        """
+
+        # check file_id
+        if any(id < 0 or id > 3 for id in files):
+            self.logger.warning("file_id out of range [0, 3]")
+            files = [id for id in files if 0 <= id <= 3]
+
+        def probe_single(task: tuple) -> dict:
+            kwargs = self.get_download.copy()
+            kwargs["url"] += str(task[0]) + self.file_folder[task[1]][0]
+            return probe(kwargs, self.headers_pool, self.logger)
+
+        # TC_*.txt carries the date when the other files don't
+        probes = files if 2 in files else files + [2]
+        executor = ThreadPoolExecutor(self.preflight_workers)
+        futures = dict()  # the probes in flight of each index
+
+        def submit(index: int) -> None:
+            futures[index] = [
+                executor.submit(probe_single, (index, id)) for id in probes
+            ]
+
+        # only probe a few indices ahead to keep the workers busy
+        window = -(-self.preflight_workers // len(probes))
+        for index in indices[:window]:
+            submit(index)
+
+        plan = list()
+        num_probed = 0
+        try:
+            for index in indices:
+                if num_probed + window < len(indices):
+                    submit(indices[num_probed + window])
+                num_probed += 1
+                num_missing = 0
+
+                for file_id, future in zip(probes, futures.pop(index)):
+                    meta = future.result()
+
+                    # failed to probe; leave it to the download
+                    if meta is None:
+                        if file_id in files:
+                            plan.append((0, index, file_id))
+                        continue
+
+                    # index out of range
+                    if meta["type"] == "text/html; charset=utf-8":
+                        num_missing += 1
+                        if file_id in files:
+                            self.logger.debug(
+                                "File not found: '%s', index %d",
+                                default_filenames[file_id][:-4],
+                                index,
+                                extra=task_extra(index, file_id, 2))
+                        continue
+
+                    # extract date from filename; TC_*.txt first
+                    if meta["filename"]:
+                        filedate = re.findall(r"[0-9]+", meta["filename"])
+                        if filedate and (file_id == 2
+                                         or index not in self.dates):
+                            self.dates[index] = filedate[0]
+
+                    if file_id in files:
+                        plan.append((meta["size"], index, file_id))
+
+                # no need to probe after the last trade date
+                if index in self.dates and self.dates[index] == last_date:
+                    break
+
+                # every file is missing; past the last index
+                if num_probed > 1 and num_missing == len(probes):
+                    break
+
+        finally:
+            # don't wait for the probes not needed (or on Ctrl+C)
+            for group in futures.values():
+                for future in group:
+                    future.cancel()
+            executor.shutdown(wait=False)
+
+        plan.sort(key=lambda task: task[0], reverse=True)
+        self.logger.info("Plan index %d-%d: %d files, %d bytes, %d skipped",
+                         indices[0], indices[num_probed - 1], len(plan),
+                         sum(task[0] for task in plan),
+                         num_probed * len(files) - len(plan))
+
+        return [task[1:] for task in plan]
+
     def download_specify(self,
                          files: list,
                          today_only: bool = False,
@@ -209,12 +407,14 @@ class sgx_crawler:
 
         # check file_id
         if file_id < 0 or file_id > 3:
-            self.logger.warning("file_id out of range [0, 3]")
+            self.logger.warning("file_id out of range [0, 3]",
+                                extra=task_extra(index, file_id, 0))
             return 0
 
         # check index
         if index < 1:
-            self.logger.warning("index out of range [1, ]")
+            self.logger.warning("index out of range [1, ]",
+                                extra=task_extra(index, file_id, 0))
             return 0
 
         # config the download link
@@ -228,14 +428,18 @@ class sgx_crawler:
         if r is None:
             self.pendings.append((index, file_id))
             self.logger.error(
-                "Fail to download/write: index %d, file_id %d; retry later" %
-                (index, file_id))
+                "Fail to download/write: index %d, file_id %d; retry later",
+                index,
+                file_id,
+                extra=task_extra(index, file_id, 1))
             return 1
 
         # index out of range
         if r.headers["Content-Type"] == "text/html; charset=utf-8":
-            self.logger.warning("File not found: '%s', index %d" %
-                                (default_filenames[file_id][:-4], index))
+            self.logger.warning("File not found: '%s', index %d",
+                                default_filenames[file_id][:-4],
+                                index,
+                                extra=task_extra(index, file_id, 2))
             return 2
 
         # the right file
@@ -244,6 +448,10 @@ class sgx_crawler:
             filename = re.findall(r"[\S]+\s[a-z]+=([\S]+)",
                                   r.headers["Content-Disposition"])[0]
 
+            # date found by probes
+            if self.datestr[0] != index and index in self.dates:
+                self.datestr = [index, self.dates[index]]
+
             # if we don't have the date
             if self.datestr[0] != index:
                 # extract date from filename
@@ -265,8 +473,8 @@ class sgx_crawler:
                         self.datestr = [index, filedate]
                     except Exception:
                         self.logger.warning(
-                            "Fail to get the date; use index in the filename instead"
-                        )
+                            "Fail to get the date; use index in the filename instead",
+                            extra=task_extra(index, file_id))
 
             name_ext = filename.split(".")
             mid = self.datestr[1] if self.datestr[0] == index else str(index)
@@ -279,11 +487,17 @@ class sgx_crawler:
             if not write(self.file_folder[file_id][1], filename, r,
                          self.logger, refresh):
                 self.logger.error(
-                    "Fail to download/write: index %d, file_id %d; add to pendings"
-                    % (index, file_id))
+                    "Fail to download/write: index %d, file_id %d; add to pendings",
+                    index,
+                    file_id,
+                    extra=task_extra(index, file_id, 1))
                 self.pendings.append((index, file_id))
                 return 1
             # success
+            self.logger.debug("Success: '%s', index %d",
+                              filename,
+                              index,
+                              extra=task_extra(index, file_id, 3))
             return 3
 
     def get_last(self) -> str:
@@ -1,8 +1,11 @@
 import os
 import re
 import json
+import queue
+import atexit
 import pprint
 import logging
+import logging.handlers
 import requests
 from time import sleep
 from random import randint
@@ -23,6 +26,139 @@ def show_config(crawler_config: dict, logger: logging.Logger) -> None:
     printout((logger.name, logger, []))
 
 
+class JsonFormatter(logging.Formatter):
+    """Format each record as a JSON line; task fields are kept if given"""
+
+    task_fields = ("index", "file_id", "status")
+
+    def format(self, record: logging.LogRecord) -> str:
+        line = {
+            "time": self.formatTime(record, self.datefmt),
+            "level": record.levelname,
+            "message": record.getMessage()
+        }
+
+        # fields passed through `extra` by download tasks
+        for field in self.task_fields:
+            if hasattr(record, field):
+                line[field] = getattr(record, field)
+
+        return json.dumps(line)
+
+
+def task_extra(index: int, file_id: int, status: int = None) -> dict:
+    """Build the task fields of a log record for JsonFormatter
+
+    :param index: the index of the trade date
+    :param file_id: the file to download, range [0, 3]
+    :param status: the status indicator of download_single, default None
+    :return: the `extra` of the log record
+    """
+
+    extra = {"index": index, "file_id": file_id}
+    if status is not None:
+        extra["status"] = status
+
+    return extra
+
+
+class QueueLogListener(logging.handlers.QueueListener):
+    """A QueueListener which can be stopped more than once"""
+
+    running = False
+
+    def start(self) -> None:
+        super().start()
+        self.running = True
+
+    def stop(self) -> None:
+        if self.running:
+            self.running = False
+            super().stop()
+
+
+def log_handlers(logger: logging.Logger) -> list:
+    """Get the handlers of the Logger, including those behind a QueueHandler
+
+    :param logger: the Logger
+    :return: a list of handlers
+    """
+
+    handlers = logger.handlers.copy()
+    for handler in logger.handlers:
+        listener = getattr(handler, "listener", None)
+        if listener is not None:
+            handlers.extend(listener.handlers)
+
+    return handlers
+
+
+def json_logging(logger: logging.Logger,
+                 log_path: str) -> logging.FileHandler:
+    """Write the records of the Logger to a file as JSON lines
+
+    :param logger: the Logger
+    :param log_path: the path of the JSON lines file
+    :return: the handler of the file (reused if exists)
+    """
+
+    log_path = os.path.abspath(log_path)
+    for handler in log_handlers(logger):
+        if getattr(handler, "baseFilename", None) == log_path:
+            return handler
+
+    handler = logging.FileHandler(log_path)
+    handler.setFormatter(JsonFormatter("%(message)s", "%Y-%m-%d %H:%M:%S"))
+    logger.addHandler(handler)
+
+    return handler
+
+
+def queue_logging(logger: logging.Logger) -> QueueLogListener:
+    """Move the handlers of the Logger to a background thread
+
+    :param logger: the Logger
+    :return: the started QueueLogListener (stopped at exit)
+    """
+
+    for queue_handler in logger.handlers.copy():
+        listener = getattr(queue_handler, "listener", None)
+        if not isinstance(listener, QueueLogListener):
+            continue
+
+        # already moved; move the new handlers to the running listener
+        if listener.running:
+            handlers = [
+                handler for handler in logger.handlers
+                if handler is not queue_handler
+            ]
+            for handler in handlers:
+                logger.removeHandler(handler)
+            listener.handlers += tuple(handlers)
+            return listener
+
+        # stopped; put its handlers back
+        logger.removeHandler(queue_handler)
+        for handler in listener.handlers:
+            logger.addHandler(handler)
+
+    log_queue = queue.SimpleQueue()
+    handlers = logger.handlers.copy()
+    for handler in handlers:
+        logger.removeHandler(handler)
+    queue_handler = logging.handlers.QueueHandler(log_queue)
+    logger.addHandler(queue_handler)
+
+    listener = QueueLogListener(log_queue,
+                                *handlers,
+                                respect_handler_level=True)
+    queue_handler.listener = listener
+    listener.start()
+    atexit.register(listener.stop)  # flush the queue before leaving
+
+    return listener
+
+
 def load_config(config_path: str, logger: logging.Logger = None) -> dict:
     """Load the configuration
 
@@ -36,7 +172,7 @@ def load_config(config_path: str, logger: logging.Logger = None) -> dict:
             config = json.load(cfg)
 
         if logger:
-            logger.debug("Success to load file: '%s'" % config_path)
+            logger.debug("Success to load file: '%s'", config_path)
 
         return config
 
@@ -93,6 +229,38 @@ def get(kwargs: dict, headers_pool: list,
     return None
 
 
+def probe(kwargs: dict, headers_pool: list, logger: logging.Logger) -> dict:
+    """Get the headers of a file without downloading the body
+
+    :param kwargs: the parameters of requests.get (except headers)
+    :param headers_pool: a list of headers
+    :param logger: the Logger
+    :return: the metadata: type, filename and size (None if failed)
+    """
+
+    kwargs = dict(kwargs, stream=True)  # close before reading the body
+    r = get(kwargs, headers_pool, logger)
+
+    if r is None:
+        return None
+
+    try:
+        filename = re.findall(r"[\S]+\s[a-z]+=([\S]+)",
+                              r.headers.get("Content-Disposition", ""))
+        return {
+            "type": r.headers.get("Content-Type"),
+            "filename": filename[0] if filename else None,
+            "size": int(r.headers.get("Content-Length", 0))
+        }
+
+    except Exception as e:
+        logger.exception(e, exc_info=False)
+        return None
+
+    finally:
+        r.close()
+
+
 def write(folder: str,
           filename: str,
           r: requests.Response,
@@ -109,7 +277,7 @@ def write(folder: str,
 
     # create folder if not exists
     if not os.path.exists(folder):
-        logger.info("Create the directory: '%s'" % folder)
+        logger.info("Create the directory: '%s'", folder)
         os.makedirs(folder)
 
     # config the path
@@ -117,7 +285,7 @@ def write(folder: str,
 
     # if exists, no need to write
     if os.path.exists(file_path) and not replace:
-        logger.debug("File '%s' already exists" % filename)
+        logger.debug("File '%s' already exists", filename)
         return True
     # write file
     else:
@@ -125,7 +293,7 @@ def write(folder: str,
             with open(file_path, 'wb') as f:
                 for data in r.iter_content(chunk_size=512):
                     f.write(data)
-            logger.debug("Success to write file: '%s'" % filename)
+            logger.debug("Success to write file: '%s'", filename)
             return True
 
         # failed